@@ -6,17 +6,16 @@ This module provides function tools for interacting with the Ansible AWX API thr
 
 import os
 import json
+import asyncio
+import functools
 import requests
 from typing import Dict, List, Any, Optional, Union
 from urllib.parse import urljoin
-from dotenv import load_dotenv
 from agents import function_tool
 import shutil
 import traceback
 
-load_dotenv()
-
-# Configuration
+# Configuration (os.environ is filled from .env by settings, imported first by main.py)
 ANSIBLE_BASE_URL = os.getenv("ANSIBLE_BASE_URL")
 ANSIBLE_USERNAME = os.getenv("ANSIBLE_USERNAME")
 ANSIBLE_PASSWORD = os.getenv("ANSIBLE_PASSWORD")
@@ -180,8 +179,19 @@ def handle_pagination(client: AnsibleClient, endpoint: str, params: Dict = None)
             
     return results
 
+def run_in_thread(func):
+    """
+    Run a blocking (requests based) tool in a worker thread so it doesn't stall the event loop.
+    Must be placed under @function_tool, the wrapper keeps the signature and docstring used for the tool schema.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
 # Special tool for read the documentation of the AWX API
 @function_tool
+@run_in_thread
 def list_api_paths() -> str:
     """
     List all API paths of the current AWX API.
@@ -191,6 +201,7 @@ def list_api_paths() -> str:
     return resp.text
 
 @function_tool
+@run_in_thread
 def document_search(url: str) -> str:
     """
     Search the documentation of the AWX API.
@@ -256,6 +267,7 @@ def document_search(url: str) -> str:
     return resp.text
 
 @function_tool
+@run_in_thread
 def check_project_manual_path(type: str, path: str, filename: str = None, content: str = None) -> str:
     """
     Check and manage project manual paths.
@@ -332,6 +344,7 @@ def check_project_manual_path(type: str, path: str, filename: str = None, conten
         })
 
 @function_tool
+@run_in_thread
 def call_awx_api(method: str, endpoint: str, params: Dict = None, data: Dict = None) -> str:
     """
     Call the AWX API.
@@ -359,6 +372,7 @@ def call_awx_api(method: str, endpoint: str, params: Dict = None, data: Dict = N
 
 
 @function_tool
+@run_in_thread
 def list_inventories(page_size: int = 100, page: int = 1) -> str:
     """List all inventories.
     
@@ -372,6 +386,7 @@ def list_inventories(page_size: int = 100, page: int = 1) -> str:
         return json.dumps(inventories, indent=2)
 
 @function_tool
+@run_in_thread
 def get_inventory(inventory_id: int) -> str:
     """Get details about a specific inventory.
     
@@ -383,6 +398,7 @@ def get_inventory(inventory_id: int) -> str:
         return json.dumps(inventory, indent=2)
 
 @function_tool
+@run_in_thread
 def create_inventory(name: str, organization_id: int, description: str = "") -> str:
     """Create a new inventory.
     
@@ -401,6 +417,7 @@ def create_inventory(name: str, organization_id: int, description: str = "") ->
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def update_inventory(inventory_id: int, name: str = None, description: str = None) -> str:
     """Update an existing inventory.
     
@@ -420,6 +437,7 @@ def update_inventory(inventory_id: int, name: str = None, description: str = Non
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def delete_inventory(inventory_id: int) -> str:
     """Delete an inventory."""
     with get_ansible_client() as client:
@@ -443,6 +461,7 @@ def delete_inventory(inventory_id: int) -> str:
 # Function Tools - Host Management
 
 @function_tool
+@run_in_thread
 def list_hosts(inventory_id: int = None, page_size: int = 100, page: int = 1) -> str:
     """List hosts, optionally filtered by inventory.
     
@@ -463,6 +482,7 @@ def list_hosts(inventory_id: int = None, page_size: int = 100, page: int = 1) ->
         return json.dumps(hosts, indent=2)
 
 @function_tool
+@run_in_thread
 def get_host(host_id: int) -> str:
     """Get details about a specific host.
     
@@ -474,6 +494,7 @@ def get_host(host_id: int) -> str:
         return json.dumps(host, indent=2)
 
 @function_tool
+@run_in_thread
 def create_host(name: str, inventory_id: int, variables: str = "{}", description: str = "") -> str:
     """Create a new host in an inventory.
     
@@ -499,6 +520,7 @@ def create_host(name: str, inventory_id: int, variables: str = "{}", description
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def update_host(host_id: int, name: str = None, variables: str = None, description: str = None) -> str:
     """Update an existing host.
     
@@ -527,6 +549,7 @@ def update_host(host_id: int, name: str = None, variables: str = None, descripti
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def delete_host(host_id: int) -> str:
     """Delete a host.
     
@@ -540,6 +563,7 @@ def delete_host(host_id: int) -> str:
 # Function Tools - Job Template Management
 
 @function_tool
+@run_in_thread
 def list_job_templates(page_size: int = 100, page: int = 1) -> str:
     """List all job templates.
     
@@ -553,6 +577,7 @@ def list_job_templates(page_size: int = 100, page: int = 1) -> str:
         return json.dumps(templates, indent=2)
 
 @function_tool
+@run_in_thread
 def get_job_template(template_id: int) -> str:
     """Get details about a specific job template.
     
@@ -564,6 +589,7 @@ def get_job_template(template_id: int) -> str:
         return json.dumps(template, indent=2)
 
 @function_tool
+@run_in_thread
 def create_job_template(
     name: str, 
     inventory_id: int,
@@ -608,6 +634,7 @@ def create_job_template(
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def launch_job(template_id: int, extra_vars: str = None) -> str:
     """Launch a job from a job template.
     
@@ -632,6 +659,7 @@ def launch_job(template_id: int, extra_vars: str = None) -> str:
 # Function Tools - Job Management
 
 @function_tool
+@run_in_thread
 def list_jobs(status: str = None, page_size: int = 100, page: int = 1) -> str:
     """List all jobs, optionally filtered by status.
     
@@ -649,6 +677,7 @@ def list_jobs(status: str = None, page_size: int = 100, page: int = 1) -> str:
         return json.dumps(jobs, indent=2)
 
 @function_tool
+@run_in_thread
 def get_job(job_id: int) -> str:
     """Get details about a specific job.
     
@@ -660,6 +689,7 @@ def get_job(job_id: int) -> str:
         return json.dumps(job, indent=2)
 
 @function_tool
+@run_in_thread
 def cancel_job(job_id: int) -> str:
     """Cancel a running job.
     
@@ -671,6 +701,7 @@ def cancel_job(job_id: int) -> str:
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def get_job_stdout(job_id: int, format: str = "txt") -> str:
     """Get the standard output of a job."""
     if format not in ["txt", "html", "json", "ansi"]:
@@ -688,6 +719,7 @@ def get_job_stdout(job_id: int, format: str = "txt") -> str:
 # Function Tools - Project Management
 
 @function_tool
+@run_in_thread
 def list_projects(page_size: int = 100, page: int = 1) -> str:
     """List all projects.
     
@@ -701,6 +733,7 @@ def list_projects(page_size: int = 100, page: int = 1) -> str:
         return json.dumps(projects, indent=2)
 
 @function_tool
+@run_in_thread
 def get_project(project_id: int) -> str:
     """Get details about a specific project.
     
@@ -712,6 +745,7 @@ def get_project(project_id: int) -> str:
         return json.dumps(project, indent=2)
 
 @function_tool
+@run_in_thread
 def create_project(
     name: str,
     organization_id: int,
@@ -759,6 +793,7 @@ def create_project(
 # Function Tools - Organization Management
 
 @function_tool
+@run_in_thread
 def list_organizations(page_size: int = 100, page: int = 1) -> str:
     """List all organizations.
     
@@ -772,6 +807,7 @@ def list_organizations(page_size: int = 100, page: int = 1) -> str:
         return json.dumps(organizations, indent=2)
 
 @function_tool
+@run_in_thread
 def get_organization(organization_id: int) -> str:
     """Get details about a specific organization.
     
@@ -783,6 +819,7 @@ def get_organization(organization_id: int) -> str:
         return json.dumps(organization, indent=2)
 
 @function_tool
+@run_in_thread
 def create_organization(name: str, description: str = "") -> str:
     """Create a new organization.
     
@@ -801,6 +838,7 @@ def create_organization(name: str, description: str = "") -> str:
 # Function Tools - Credential Management
 
 @function_tool
+@run_in_thread
 def list_credentials(page_size: int = 100, page: int = 1) -> str:
     """List all credentials.
     
@@ -814,6 +852,7 @@ def list_credentials(page_size: int = 100, page: int = 1) -> str:
         return json.dumps(credentials, indent=2)
 
 @function_tool
+@run_in_thread
 def get_credential(credential_id: int) -> str:
     """Get details about a specific credential.
     
@@ -825,6 +864,7 @@ def get_credential(credential_id: int) -> str:
         return json.dumps(credential, indent=2)
 
 @function_tool
+@run_in_thread
 def create_credential(
     name: str,
     credential_type: int,
@@ -895,6 +935,7 @@ def create_credential(
         return json.dumps(response, indent=2)
 
 @function_tool
+@run_in_thread
 def update_credential(
     credential_id: int,
     name: str = None,
@@ -964,6 +1005,7 @@ def update_credential(
 # Function Tools - User Management
 
 @function_tool
+@run_in_thread
 def list_users(page_size: int = 100, page: int = 1) -> str:
     """List all users.
     
@@ -977,6 +1019,7 @@ def list_users(page_size: int = 100, page: int = 1) -> str:
         return json.dumps(users, indent=2)
 
 @function_tool
+@run_in_thread
 def get_user(user_id: int) -> str:
     """Get details about a specific user.
     
@@ -990,6 +1033,7 @@ def get_user(user_id: int) -> str:
 # Function Tools - System Information
 
 @function_tool
+@run_in_thread
 def get_ansible_version() -> str:
     """Get Ansible Tower/AWX version information."""
     with get_ansible_client() as client:
@@ -997,9 +1041,19 @@ def get_ansible_version() -> str:
         return json.dumps(info, indent=2)
 
 @function_tool
+@run_in_thread
 def get_dashboard_stats() -> str:
     """Get dashboard statistics."""
     with get_ansible_client() as client:
         stats = client.request("GET", "/api/v2/dashboard/")
         return json.dumps(stats, indent=2)
-    
\ No newline at end of file
+    
+# Tool set of the AWX worker agent: the meta-tools that document and call any api/v2 endpoint.
+# Built once here so the worker doesn't import and list the tools itself.
+AWX_WORKER_TOOLS = (
+    # Special tool for read the documentation of the AWX API
+    document_search,
+    list_api_paths,
+    call_awx_api,
+    check_project_manual_path,
+)
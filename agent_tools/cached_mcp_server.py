@@ -0,0 +1,62 @@
+"""
+MCP server with a persisted tool list
+
+`cache_tools_list=True` only caches the tool list inside the process, so every worker start re-fetches it
+from the (remote) MCP endpoint. This server keeps a snapshot of the tool list on disk and serves it until it expires.
+"""
+
+import time
+import logging
+import hashlib
+import orjson
+from pathlib import Path
+from mcp.types import Tool as MCPTool
+from agents import mcp
+
+logger = logging.getLogger(__name__)
+
+# Snapshots older than this are ignored and refreshed from the server
+TOOLS_CACHE_MAX_AGE = 24 * 60 * 60
+
+
+class CachedToolsMCPServerStreamableHttp(mcp.server.MCPServerStreamableHttp):
+    def __init__(self, params, cache_file: Path, **kwargs):
+        super().__init__(params=params, cache_tools_list=True, **kwargs)
+        self.cache_file = cache_file
+        # The snapshot is only valid for the endpoint it was taken from
+        self.cache_hash = hashlib.sha256(params["url"].encode()).hexdigest()
+        snapshot = self._load_snapshot()
+        if snapshot is not None:
+            self._tools_list = snapshot
+            self._cache_dirty = False
+
+    def _load_snapshot(self):
+        try:
+            data = orjson.loads(self.cache_file.read_bytes())
+            if data["hash"] != self.cache_hash or time.time() - data["saved_at"] > TOOLS_CACHE_MAX_AGE:
+                return None
+            return [MCPTool.model_validate(tool) for tool in data["tools"]]
+        except (OSError, ValueError, KeyError) as e:
+            logger.info("MCP tools cache not used (%s): %s", self.cache_file, e)
+            return None
+
+    def _save_snapshot(self):
+        try:
+            self.cache_file.write_bytes(orjson.dumps({
+                "hash": self.cache_hash,
+                "saved_at": time.time(),
+                "tools": [tool.model_dump(mode="json") for tool in self._tools_list],
+            }))
+        except OSError as e:
+            logger.warning("Could not write MCP tools cache (%s): %s", self.cache_file, e)
+
+    def invalidate_tools_cache(self):
+        super().invalidate_tools_cache()
+        self.cache_file.unlink(missing_ok=True)
+
+    async def list_tools(self, *args, **kwargs):
+        fetched = self._tools_list is None or self._cache_dirty
+        tools = await super().list_tools(*args, **kwargs)
+        if fetched and self._tools_list is not None:
+            self._save_snapshot()
+        return tools
@@ -0,0 +1,75 @@
+"""
+Process-wide MCP sessions
+
+Each MCP server is connected once and its session is reused by every agent run, instead of paying the
+streamable-http bootstrap (connect + initialize + initialized notification) again.
+A supervisor task per server owns the session: it connects, pings it every MCP_KEEPALIVE_INTERVAL seconds
+and reconnects when the ping fails. Connect and cleanup run in that same task, as the MCP transport requires.
+"""
+
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+MCP_KEEPALIVE_INTERVAL = int(os.getenv("MCP_KEEPALIVE_INTERVAL", 60))
+
+
+class MCPSessionPool:
+    def __init__(self, servers, keepalive_interval: int = MCP_KEEPALIVE_INTERVAL):
+        self.servers = tuple(servers)
+        self.keepalive_interval = keepalive_interval
+        self._lock = asyncio.Lock()
+        self._tasks = {}
+
+    async def connect_all(self):
+        """
+        Start the supervisor of every server (only once) and wait for their first connection attempt.
+        A server that can't be reached doesn't block startup; its supervisor keeps retrying.
+        """
+        async with self._lock:
+            waiters = []
+            for server in self.servers:
+                if server.name in self._tasks:
+                    continue
+                ready = asyncio.Event()
+                self._tasks[server.name] = asyncio.create_task(self._supervise(server, ready))
+                waiters.append(ready.wait())
+            await asyncio.gather(*waiters)
+
+    async def close_all(self):
+        """
+        Stop the supervisors and close their sessions (FastAPI lifespan shutdown).
+        """
+        async with self._lock:
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _supervise(self, server, ready: asyncio.Event):
+        try:
+            while True:
+                try:
+                    if server.session is None:
+                        await server.connect()
+                        logger.info("MCP server '%s' connected", server.name)
+                    else:
+                        await server.session.send_ping()
+                except Exception as e:
+                    logger.warning("MCP server '%s' unavailable, retrying in %ss: %s", server.name, self.keepalive_interval, e)
+                    await self._cleanup(server)
+                finally:
+                    ready.set()
+                await asyncio.sleep(self.keepalive_interval)
+        finally:
+            await self._cleanup(server)
+
+    @staticmethod
+    async def _cleanup(server):
+        try:
+            await server.cleanup()
+        except Exception as e:
+            logger.warning("Error closing MCP server '%s': %s", server.name, e)
@@ -0,0 +1,77 @@
+import os
+import time
+import asyncio
+import logging
+import redis
+from typing import Dict
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two refreshes of this worker's connections in Redis
+CONNECTION_HEARTBEAT_INTERVAL = int(os.getenv("WS_CONNECTION_HEARTBEAT_INTERVAL", 30))
+
+
+class RedisConnectionRegistry:
+    """
+    Keep track of WebSocket connections across uvicorn workers.
+    A socket only lives in the worker that accepted it. Every worker records its users in a Redis sorted set,
+    scored by the last time it refreshed them, so the entries of a worker that crashed age out of count().
+    """
+    def __init__(self, client, prefix: str = "awx_ws", heartbeat_interval: int = CONNECTION_HEARTBEAT_INTERVAL):
+        self.client = client
+        self.prefix = prefix
+        self.key = f"{prefix}_connections_seen"
+        self.heartbeat_interval = heartbeat_interval
+        self.local: Dict[str, WebSocket] = {}
+        self._heartbeat = None
+
+    async def start(self):
+        """
+        Start refreshing this worker's connections (FastAPI lifespan startup).
+        """
+        self._heartbeat = asyncio.create_task(self._refresh())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self.local:
+                continue
+            try:
+                now = time.time()
+                await self.client.zadd(self.key, {user_id: now for user_id in self.local})
+            except redis.RedisError as e:
+                logger.error("Error refreshing WebSocket connections in Redis: %s", e)
+
+    # Redis only backs the connection count: a Redis error is logged and never fails the socket itself
+    async def register(self, user_id: str, websocket: WebSocket):
+        self.local[user_id] = websocket
+        try:
+            await self.client.zadd(self.key, {user_id: time.time()})
+        except redis.RedisError as e:
+            logger.error("Error registering WebSocket connection in Redis: %s", e)
+
+    async def unregister(self, user_id: str):
+        if user_id in self.local:
+            del self.local[user_id]
+            try:
+                await self.client.zrem(self.key, user_id)
+            except redis.RedisError as e:
+                logger.error("Error unregistering WebSocket connection in Redis: %s", e)
+
+    async def count(self) -> int:
+        """
+        Number of connected users across all workers.
+        Entries not refreshed for two heartbeats (their worker is gone) are dropped first.
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(self.key, "-inf", time.time() - 2 * self.heartbeat_interval)
+            pipe.zcard(self.key)
+            _, count = await pipe.execute()
+        return count
@@ -1,77 +1,265 @@
 import redis
-import json
+import orjson
 import os
-from dotenv import load_dotenv
+import asyncio
+import logging
+import base64
+import zstandard
+from cachetools import TTLCache
+from conversations.redis_pool import redis_client
 
-# --- Load Environment Variables ---
-load_dotenv()
-# --- Redis Client Initialization ---
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    db=int(os.getenv("REDIS_DB", 0)),
-    password=os.getenv("REDIS_PASSWORD")
-)
+logger = logging.getLogger(__name__)
 
-def get_history(user_id: str, all_fields: bool = False):
+# Long tool results are re-sent to Redis and the LLM on every turn, so cap each stored string field.
+# Set HISTORY_MAX_FIELD_LENGTH=0 to disable truncation.
+MAX_FIELD = int(os.getenv("HISTORY_MAX_FIELD_LENGTH", 8192))
+# Only the last HISTORY_MAX messages are kept in Redis and sent back to the LLM.
+HISTORY_MAX = int(os.getenv("HISTORY_MAX", 20))
+# Conversations expire after this many seconds without being read or written.
+HISTORY_TTL = int(os.getenv("HISTORY_TTL", 86400))
+# History is a Redis LIST per user, newest message first: a turn only pushes its new messages instead of rewriting the whole conversation.
+HISTORY_KEY_PREFIX = "awx_chat_list_"
+# Before the list, the whole conversation was one JSON blob (oldest first, no TTL) under this prefix.
+# It is moved into the list the first time the user's list is read empty (see migrate_legacy_history).
+LEGACY_HISTORY_KEY_PREFIX = "awx_chat_"
+# Messages whose JSON is at least this long (typically tool results) are stored zstd-compressed. Set to 0 to disable.
+# The pool decodes responses as text, so compressed items are base64 encoded behind a "zstd:" prefix; plain JSON items still read as is.
+COMPRESS_MIN_SIZE = int(os.getenv("HISTORY_COMPRESS_MIN_SIZE", 1024))
+_ZSTD_PREFIX = "zstd:"
+_zstd_compressor = zstandard.ZstdCompressor(level=3)
+_zstd_decompressor = zstandard.ZstdDecompressor()
+
+# Write-through cache of the decoded history per user, so a follow-up turn handled by the same worker skips the Redis read and JSON decode.
+# Only consistent when a user is always routed to the same worker (sticky sessions), so only the WebSocket path reads it:
+# Slack webhooks land on any worker and read with use_cache=False.
+_history_cache: TTLCache = TTLCache(maxsize=4096, ttl=300)
+
+def invalidate_history_cache(user_id: str):
+    """
+    Drop the cached history of a user (e.g. when their WebSocket disconnects).
+    """
+    _history_cache.pop(user_id, None)
+
+def truncate_history(history):
+    """
+    Return a copy of the last HISTORY_MAX history items where every string field longer than MAX_FIELD is cut to its head + "...[truncated]".
+    """
+    history = history[-HISTORY_MAX:]
+    if MAX_FIELD <= 0:
+        return history
+    result = []
+    for item in history:
+        result.append({
+            key: value[:MAX_FIELD] + "...[truncated]" if isinstance(value, str) and len(value) > MAX_FIELD else value
+            for key, value in item.items()
+        })
+    return result
+
+def history_key(user_id: str) -> str:
+    return f"{HISTORY_KEY_PREFIX}{user_id}"
+
+def encode_message(message) -> bytes:
+    """
+    Serialize one history message for Redis, compressing it when it is large.
+    """
+    raw = orjson.dumps(message)
+    if COMPRESS_MIN_SIZE <= 0 or len(raw) < COMPRESS_MIN_SIZE:
+        return raw
+    return _ZSTD_PREFIX.encode() + base64.b64encode(_zstd_compressor.compress(raw))
+
+def decode_message(item: str):
+    """
+    Deserialize one history message read from Redis (compressed or plain JSON).
+    """
+    if item.startswith(_ZSTD_PREFIX):
+        try:
+            return orjson.loads(_zstd_decompressor.decompress(base64.b64decode(item[len(_ZSTD_PREFIX):])))
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Corrupted compressed history item: {e}") from e
+    return orjson.loads(item)
+
+async def get_history(user_id: str, all_fields: bool = False, use_cache: bool = True):
     """
     Get the saved history of the conversation for a given user and project from Redis.
-    If the history contains more than 20 items, only the last 20 are returned.
+    Only the last HISTORY_MAX items are returned, oldest first.
+    Reading the history also refreshes its TTL (LRANGE + EXPIRE in one round-trip), so active conversations don't expire.
     """
     if redis_client is None:
-        print("Redis not available, returning empty history")
+        logger.warning("Redis not available, returning empty history")
         return []
         
-    redis_key = f"awx_chat_{user_id}"
+    redis_key = history_key(user_id)
     try:
-        user_data = redis_client.get(redis_key)
+        user_data = _history_cache.get(user_id) if use_cache else None
         if user_data is None:
-            return []
-        user_data = json.loads(user_data)
-        if not isinstance(user_data, list):
-            return []
-        if all_fields:
-            return user_data[-20:]
-        else:
-            result = []
-            for item in user_data:
-                result.append({
-                    "role": item["role"],
-                    "content": item["content"]
-                })
-            return result[-20:]
-    except (redis.RedisError, json.JSONDecodeError) as e:
-        print(f"Error getting history from Redis: {e}")
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.lrange(redis_key, 0, HISTORY_MAX - 1)
+                pipe.expire(redis_key, HISTORY_TTL)
+                user_data, _ = await pipe.execute()
+            if not user_data:
+                user_data = await migrate_legacy_history(user_id)
+            return decode_history(user_id, user_data, all_fields, use_cache)
+        return select_history_fields(user_data, all_fields)
+    except (redis.RedisError, ValueError) as e:
+        logger.error("Error getting history from Redis: %s", e)
     return []
 
-def save_history(user_id: str, new_history):
+async def migrate_legacy_history(user_id: str):
+    """
+    Move a conversation saved in the old single-blob format into the history list and delete the blob.
+    Returns the migrated items as read from the list (newest first), or [] when there was nothing to migrate.
+    """
+    legacy_key = f"{LEGACY_HISTORY_KEY_PREFIX}{user_id}"
+    # GET + DEL in one transaction, so concurrent readers can't migrate the same blob twice
+    async with redis_client.pipeline() as pipe:
+        pipe.get(legacy_key)
+        pipe.delete(legacy_key)
+        blob, _ = await pipe.execute()
+    if blob is None:
+        return []
+    try:
+        messages = orjson.loads(blob)
+    except orjson.JSONDecodeError as e:
+        logger.warning("Dropping unreadable legacy history of user %s: %s", user_id, e)
+        return []
+    if not isinstance(messages, list):
+        return []
+    messages = truncate_history([message for message in messages if isinstance(message, dict)])
+    if not messages:
+        return []
+    # Newest first, like the list. RPUSH appends at the tail, behind anything written since the list was read.
+    items = [encode_message(message).decode() for message in reversed(messages)]
+    redis_key = history_key(user_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.rpush(redis_key, *items)
+        pipe.ltrim(redis_key, 0, HISTORY_MAX - 1)
+        pipe.expire(redis_key, HISTORY_TTL)
+        await pipe.execute()
+    logger.info("Migrated %d legacy history messages of user %s", len(items), user_id)
+    return items
+
+def decode_history(user_id: str, user_data, all_fields: bool = False, use_cache: bool = True):
     """
-    Save the updated conversation history back to Redis.
+    Decode the raw history items read from Redis (newest first), cache them for the user (unless use_cache is False)
+    and return them oldest first.
+    """
+    if not user_data:
+        return []
+    user_data = [decode_message(item) for item in reversed(user_data)]
+    if use_cache:
+        _history_cache[user_id] = user_data
+    return select_history_fields(user_data, all_fields)
+
+def select_history_fields(user_data, all_fields: bool = False):
+    """
+    Return the last HISTORY_MAX history items, keeping only role and content unless all_fields is set.
+    """
+    if all_fields:
+        return user_data[-HISTORY_MAX:]
+    else:
+        result = []
+        for item in user_data[-HISTORY_MAX:]:
+            result.append({
+                "role": item["role"],
+                "content": item["content"]
+            })
+        return result
+
+def _push_history(pipe, user_id: str, new_messages):
+    # LPUSH inserts its arguments one by one at the head, so the newest message ends up first
+    redis_key = history_key(user_id)
+    pipe.lpush(redis_key, *(encode_message(message) for message in new_messages))
+    pipe.ltrim(redis_key, 0, HISTORY_MAX - 1)
+    pipe.expire(redis_key, HISTORY_TTL)
+
+def _cache_new_messages(user_id: str, new_messages):
+    cached = _history_cache.get(user_id)
+    if cached is not None:
+        _history_cache[user_id] = (cached + new_messages)[-HISTORY_MAX:]
+
+async def save_history(user_id: str, new_messages):
+    """
+    Append the new messages of a turn (user message, assistant answer) to the conversation history in Redis.
     """
     if redis_client is None:
-        print("Redis not available, skipping history save")
+        logger.warning("Redis not available, skipping history save")
         return
         
-    redis_key = f"awx_chat_{user_id}"
+    new_messages = truncate_history(new_messages)
     try:
-        # Start a transaction
-        with redis_client.pipeline() as pipe:
-            # Watch the key for changes
-            pipe.watch(redis_key)
-            # Get current data
-            user_data = pipe.get(redis_key)
-            user_data = json.loads(user_data) if user_data else {}
-            # Update the history for the specific project
-            user_data = new_history
-            # Start MULTI block
-            pipe.multi()
-            # Set the new value
-            pipe.set(redis_key, json.dumps(user_data))
-            # Execute the transaction
-            pipe.execute()
-    except redis.WatchError:
-        # Handle the case where the key was modified by another client
-        print(f"WatchError: chat_{user_id} was modified, retrying transaction...")
-        save_history(user_id, new_history) # Simple retry
-    except (redis.RedisError, json.JSONDecodeError) as e:
-        print(f"Error saving history to Redis: {e}")
\ No newline at end of file
+        async with redis_client.pipeline() as pipe:
+            _push_history(pipe, user_id, new_messages)
+            await pipe.execute()
+        _cache_new_messages(user_id, new_messages)
+    except redis.RedisError as e:
+        logger.error("Error saving history to Redis: %s", e)
+
+# ==========================================================
+# --- Background history writer ---
+# Writes queued with enqueue_history are flushed to Redis in batches (one pipeline per ~20 ms window),
+# so callers don't wait on Redis before replying to the user.
+# ==========================================================
+history_write_queue: asyncio.Queue = asyncio.Queue()
+_history_writer_task = None
+
+def enqueue_history(user_id: str, new_messages):
+    """
+    Queue the new messages of a turn for the background writer.
+    The in-process cache is updated immediately so this worker reads its own write.
+    """
+    new_messages = truncate_history(new_messages)
+    _cache_new_messages(user_id, new_messages)
+    history_write_queue.put_nowait((user_id, new_messages))
+
+async def _flush_history(items):
+    # Items are appended in queue order so the messages of one user stay chronological
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id, new_messages in items:
+                _push_history(pipe, user_id, new_messages)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.error("Error saving history batch to Redis: %s", e)
+
+# Queued by stop_history_writer: the writer flushes what came before it and exits
+_STOP_WRITER = None
+
+async def _history_writer():
+    stopping = False
+    while not stopping:
+        items = [await history_write_queue.get()]
+        await asyncio.sleep(0.02)
+        while not history_write_queue.empty():
+            items.append(history_write_queue.get_nowait())
+        stopping = _STOP_WRITER in items
+        items = [item for item in items if item is not _STOP_WRITER]
+        if items:
+            await _flush_history(items)
+
+def start_history_writer():
+    """
+    Start the background history writer (FastAPI lifespan startup).
+    """
+    global _history_writer_task
+    _history_writer_task = asyncio.create_task(_history_writer())
+
+async def stop_history_writer():
+    """
+    Stop the background history writer and flush whatever is still queued (FastAPI lifespan shutdown).
+    """
+    global _history_writer_task
+    if _history_writer_task is not None:
+        # Not cancelled: a batch the writer already took off the queue would be lost mid-flush
+        history_write_queue.put_nowait(_STOP_WRITER)
+        try:
+            await _history_writer_task
+        except Exception as e:
+            logger.error("History writer failed: %s", e)
+        _history_writer_task = None
+    items = []
+    while not history_write_queue.empty():
+        item = history_write_queue.get_nowait()
+        if item is not _STOP_WRITER:
+            items.append(item)
+    if items:
+        await _flush_history(items)
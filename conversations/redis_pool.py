@@ -0,0 +1,20 @@
+import redis.asyncio
+import os
+# --- Load Environment Variables ---
+# Imported for its side effect: .env (or the compiled settings) is put into os.environ
+import settings
+# --- Shared Redis Connection Pool ---
+# Every module that talks to Redis must use this client so all of them share one pool of sockets.
+# The client is redis.asyncio, so every command has to be awaited and never blocks the event loop.
+redis_pool = redis.asyncio.ConnectionPool(
+    host=os.getenv("REDIS_HOST"),
+    port=int(os.getenv("REDIS_PORT", 6379)),
+    db=int(os.getenv("REDIS_DB", 0)),
+    password=os.getenv("REDIS_PASSWORD"),
+    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 64)),
+    socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 5)),
+    socket_connect_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 5)),
+    health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+    decode_responses=True
+)
+redis_client = redis.asyncio.Redis(connection_pool=redis_pool)
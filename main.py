@@ -2,37 +2,43 @@ import os
 import uvicorn
 import datetime
 import asyncio
-from pathlib import Path
-from dotenv import load_dotenv
+import weakref
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from typing import Dict, List
+from typing import Callable, Dict, List
 from pydantic import BaseModel, Field
 # Necessary import for checking the type of streaming event data
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
-import traceback  # Import traceback for detailed error logging
 from contextlib import asynccontextmanager
 import logfire
-import redis
-import json
+import logging
+import logging.handlers
+import queue
+import orjson
 import requests
 from requests.auth import HTTPBasicAuth
 
 # --- Load Environment Variables ---
-dotenv_file = Path(__file__).parent / ".env"
-print("DEBUG load_dotenv file:", dotenv_file)
-load_dotenv(dotenv_file)
-
-# --- Redis Client Initialization ---
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT", 6379)),      # ép int và default nếu thiếu
-    db=int(os.getenv("REDIS_DB", 0)),             # ép int và default nếu thiếu
-    password=os.getenv("REDIS_PASSWORD")
-)
+# .env (or the compiled settings in production) must be in os.environ before the clients below read it
+from settings import ENV_FILE
+
+# --- Logging Configuration ---
+# Log records are pushed to a queue and written by a background thread, so no log I/O happens on the event loop thread.
+log_queue = queue.Queue(-1)
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler, respect_handler_level=True)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener.start()
+logger = logging.getLogger(__name__)
+logger.debug("load_dotenv file: %s", ENV_FILE)
+
+# --- Redis Client (shared connection pool) ---
+from conversations.redis_pool import redis_client, redis_pool
 
 # --- SDK Configuration for Non-OpenAI Providers ---
 from agents import (
     Agent,
+    AgentOutputSchema,
     Runner,
     InputGuardrailTripwireTriggered,
     set_tracing_disabled, 
@@ -48,9 +54,9 @@ try:
         azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
     )
     set_default_openai_client(client, use_for_tracing=False)
-    print("AZURE OpenAI client set up successfully")
+    logger.info("AZURE OpenAI client set up successfully")
 except Exception as e:
-    print(f"Error setting up AZURE OpenAI client: {e}")
+    logger.error("Error setting up AZURE OpenAI client: %s", e)
     raise e
 
 set_tracing_disabled(True)
@@ -59,20 +65,28 @@ set_default_openai_api("chat_completions")
 
 # --- Import Specialist Agents & Data Models ---
 # --- Import Guardrails ---
-from sub_agents.chat_guardrails import security_request_guardrail
+from sub_agents._env import AI_MODEL
+from sub_agents.chat_guardrails import security_request_guardrail, SpeculativeGuardrail, GUARDRAIL_ENABLED
 from sub_agents.chat_agent import chat_agent
 from sub_agents.awx_worker import awx_worker_agent
-from sub_agents.awx_github_worker import awx_github_agent, connect_github_server
+from sub_agents.awx_github_worker import awx_github_agent, connect_github_server, close_github_server
 
 # --- Import Slack Functions ---
 from slack_connection.slack_functions import (
     background_slack_response, 
     login_ldap_from_slack,
-    open_login_modal
+    open_login_modal,
+    open_slack_client,
+    close_slack_client,
+    start_login_listener,
+    stop_login_listener,
+    open_awx_client,
+    close_awx_client
 )
 
 # --- Import Conversation ---
-from conversations.conversation import get_history, save_history
+from conversations.conversation import get_history, save_history, invalidate_history_cache, start_history_writer, stop_history_writer
+from conversations.connection_registry import RedisConnectionRegistry
 
 # Global variable for leader agent
 the_leader_agent = None
@@ -87,26 +101,49 @@ async def lifespan(app: FastAPI):
     logfire.instrument_openai_agents()
     logfire.instrument_openai()
 
-    print("--- Logfire configured and instrumented for FastAPI and Agents ---")
+    logger.info("--- Logfire configured and instrumented for FastAPI and Agents ---")
     
     # Connect GitHub server
     await connect_github_server()
+
+    # Start refreshing this worker's WebSocket connections in Redis
+    await connection_registry.start()
+
+    # Open the Slack Web API client (shared keep-alive session)
+    open_slack_client()
+
+    # Drop cached logged-out Slack users when they log in through another worker
+    await start_login_listener()
+
+    # Open the keep-alive HTTP client used for AWX logins from Slack
+    open_awx_client()
+
+    # Start the batched background writer for conversation history
+    start_history_writer()
     
     # Initialize leader agent
     the_leader_agent = Agent(
         name="The leader",
         instructions=the_leader_instructions,
         handoffs=[chat_agent, awx_worker_agent, awx_github_agent],
-        model=os.getenv("AI_MODEL"),
+        model=AI_MODEL,
         # Attach the input guardrail here. It will run before the agent's logic.
         # input_guardrails=[security_request_guardrail],
-        output_type=leader_output,
+        output_type=AgentOutputSchema(leader_output),
     )
     
     yield
     # This code runs on shutdown.
-    print("--- Flushing logs before shutdown ---")
+    await connection_registry.stop()
+    await close_github_server()
+    await stop_login_listener()
+    await close_slack_client()
+    await close_awx_client()
+    await stop_history_writer()
+    await redis_pool.disconnect()
+    logger.info("--- Flushing logs before shutdown ---")
     logfire.force_flush()
+    log_listener.stop()
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
@@ -167,9 +204,10 @@ When you receive any request about Job or Job Template, you MUST do these steps:
 
 # ==========================================================
 # --- WebSocket Connection Management ---
-# This dictionary will hold active connections, allowing us to manage them if needed.
+# The registry holds the connections of this worker and counts the connected users of all workers in Redis.
 # ==========================================================
-active_connections: Dict[str, WebSocket] = {}
+connection_registry = RedisConnectionRegistry(redis_client)
+# Note for clients: "awx-chat-token" messages arrive as binary frames containing UTF-8 JSON, every other message is a text frame.
 socket_request_type = {
     "chat": "awx-chat",
     "chat_token": "awx-chat-token",
@@ -185,71 +223,110 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     """
     connection_id = f"{user_id}"
     await websocket.accept()
-    active_connections[connection_id] = websocket
-    print(f"WebSocket connection established for: {connection_id}")
+    await connection_registry.register(connection_id, websocket)
+    logger.info("WebSocket connection established for: %s", connection_id)
 
     try:
         while True:
             # 1. Wait for a new message from the client and determine the target request_type.
-            print("\n" + "="*50)
-            print("[WORKFLOW] Waiting for message from client...")
+            logger.debug("[WORKFLOW] Waiting for message from client...")
             data = await websocket.receive_json()
             # Inject user/project ids for the handlers to use
             data['user_id'] = user_id
-            # print(f"[WORKFLOW] Received data: {data}")
+            # logger.debug("[WORKFLOW] Received data: %s", data)
 
             request_type = data.get("request_type", socket_request_type["chat"])
 
-            # 2. Get history from Redis. This is now the source of truth for conversation state.
-            history = get_history(user_id)
-            # 3. Dispatch the request to the correct handler based on the request_type.
+            # 2. Dispatch the request to the correct handler based on the request_type.
+            # History is read from Redis (the source of truth for conversation state) only by the branches that need it.
             if request_type == socket_request_type["chat_history"]:
-                print(f"[WORKFLOW] Sending conversation history to client")
-                await websocket.send_json({"request_type": socket_request_type["chat_history"], "content": history})
+                logger.info("[WORKFLOW] Sending conversation history to client")
+                await websocket.send_json({"request_type": socket_request_type["chat_history"], "content": await get_history(user_id)})
             elif request_type == socket_request_type["chat"]: 
-                await handle_awx_chat(websocket, data, history)
+                await handle_awx_chat(websocket, data, await get_history(user_id))
             else:
                 # Placeholder for other request_types you will add.
-                print(f"[WORKFLOW] [ERROR] Unknown request_type: '{request_type}'")
+                logger.error("[WORKFLOW] Unknown request_type: '%s'", request_type)
                 await websocket.send_json({"request_type": socket_request_type["error"], "content": f"Unknown request_type received: {request_type}"})
                 continue # Wait for the next message
 
     except WebSocketDisconnect:
-        print(f"WebSocket connection closed for: {connection_id}")
+        logger.info("WebSocket connection closed for: %s", connection_id)
     except Exception as e:
-        print(f"!!! [ERROR] An unexpected error occurred for {connection_id}: {e}")
-        traceback.print_exc()
+        logger.exception("An unexpected error occurred for %s: %s", connection_id, e)
         await websocket.send_json({"request_type": socket_request_type["error"], "content": str(e)})
     finally:
-        if connection_id in active_connections:
-            del active_connections[connection_id]
+        await connection_registry.unregister(connection_id)
+        invalidate_history_cache(user_id)
 
 
 # ==========================================================
 # AWX Chat Module Handler
 # ==========================================================
+# Token accessor per raw event class, resolved on the first event of that class instead of on every token.
+token_extractors: Dict[type, Callable] = {}
+
+def extract_token(data) -> str:
+    """
+    Return the text carried by a raw response event, or "" if the event carries none.
+    """
+    extractor = token_extractors.get(type(data))
+    if extractor is None:
+        if hasattr(data, 'delta'):
+            extractor = lambda d: d.delta or ""
+        elif isinstance(data, ChatCompletionChunk):
+            extractor = lambda d: (d.choices[0].delta.content or "") if d.choices else ""
+        else:
+            extractor = lambda d: ""
+        token_extractors[type(data)] = extractor
+    return extractor(data)
+
+# Bound the number of agent runs a single user can have streaming at the same time, so one user can't starve the event loop.
+MAX_CONCURRENT_CHATS_PER_USER = int(os.getenv("MAX_CONCURRENT_CHATS_PER_USER", 2))
+# Weak values: a user's semaphore lives as long as one of their runs holds it, whichever of their sockets started it,
+# and goes away on its own once none does (no per-disconnect cleanup that could reset it under another open socket).
+user_semaphores: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+def user_semaphore(user_id: str) -> asyncio.Semaphore:
+    semaphore = user_semaphores.get(user_id)
+    if semaphore is None:
+        semaphore = user_semaphores[user_id] = asyncio.Semaphore(MAX_CONCURRENT_CHATS_PER_USER)
+    return semaphore
+
 async def handle_awx_chat(websocket: WebSocket, data: Dict, history: List[Dict]):
     """
     Handle the AWX chat module.
     """
+    async with user_semaphore(data.get("user_id", "")):
+        await run_awx_chat(websocket, data, history)
+
+async def run_awx_chat(websocket: WebSocket, data: Dict, history: List[Dict]):
+    """
+    Run the leader agent for one chat message and stream the result to the client.
+    """
     try:
         user_id = data.get("user_id", "")
         user_message = data.get("content", "")
         
-        # Embed user_id in the message content for agent to extract
-        enhanced_message = f"[USER_ID: {user_id}] {user_message}"
-        
-        prompt_input = history.copy()
-        prompt_input.append({"role": "user", "content": enhanced_message})
+        prompt_input = [*history, {"role": "user", "content": user_message}]
         
-        print(f"[WORKFLOW] Executing agent: {the_leader_agent.name}")
-        stream = Runner.run_streamed(the_leader_agent, prompt_input, max_turns=40)
-        final_text_content = ""
+        logger.info("[WORKFLOW] Executing agent: %s", the_leader_agent.name)
+        # The guardrail check runs concurrently with the agent; its verdict is awaited before the first token is sent
+        guardrail = SpeculativeGuardrail(prompt_input) if GUARDRAIL_ENABLED else None
+        stream = Runner.run_streamed(the_leader_agent, prompt_input, max_turns=40, hooks=guardrail, context={"user_id": user_id})
         async for event in stream.stream_events():
-            if event.type == "raw_response_event" and hasattr(event.data, 'delta'):
-                token = event.data.delta or ""
-                final_text_content += token
-                await websocket.send_json({"request_type": socket_request_type["chat_token"], "content": token})
+            if event.type == "raw_response_event":
+                token = extract_token(event.data)
+                if not token:
+                    continue
+                if guardrail is not None and not guardrail.passed:
+                    try:
+                        await guardrail.check()
+                    except InputGuardrailTripwireTriggered:
+                        stream.cancel()
+                        raise
+                # Hot path: serialize once and send as a binary frame (UTF-8 JSON) instead of send_json's dumps + encode
+                await websocket.send_bytes(orjson.dumps({"request_type": socket_request_type["chat_token"], "content": token}))
             elif event.type == "tool_call_created":
                 await websocket.send_json({
                     "request_type": socket_request_type["chat"], 
@@ -258,45 +335,50 @@ async def handle_awx_chat(websocket: WebSocket, data: Dict, history: List[Dict])
             # elif event.type == "tool_call_result_created":
             #     # Có thể xử lý kết quả tool nếu cần
             #     pass
-        print("[WORKFLOW]   - Streaming complete.")
+        logger.debug("[WORKFLOW]   - Streaming complete.")
+        if guardrail is not None:
+            await guardrail.check()
 
+        final_data = None
+        new_messages = None
         if stream.final_output:
             final_data = stream.final_output.model_dump()
-            print(f"[WORKFLOW] Agent produced final output.")
-            print(f"[WORKFLOW]   - Last agent run: {stream.last_agent.name}")
-            print(f"[WORKFLOW]   - Output data type: {type(stream.final_output).__name__}")
+            logger.info("[WORKFLOW] Agent produced final output.")
+            logger.debug("[WORKFLOW]   - Last agent run: %s", stream.last_agent.name)
+            logger.debug("[WORKFLOW]   - Output data type: %s", type(stream.final_output).__name__)
             assistant_result = getattr(stream.final_output, 'result', '')
             assistant_explanation = getattr(stream.final_output, 'explanation', '')
             assistant_tool_name = getattr(stream.final_output, 'tool_name', '')
             if assistant_explanation:
                 assistant_message = {"role": "assistant", "content": assistant_explanation, "tool_result": assistant_result, "tool_name": assistant_tool_name}
-                # Save original user message without [USER_ID: xxx] prefix
-                updated_history = history + [{"role": "user", "content": user_message}, assistant_message]
-                save_history(user_id, updated_history)
-                print("[WORKFLOW]   - Conversation history saved to Redis.")
-        print("[WORKFLOW]   - Sending final 'awx-chat' payload.")
-        await websocket.send_json({"request_type": socket_request_type["chat"], "content": final_data})
+                new_messages = [{"role": "user", "content": user_message}, assistant_message]
+        # Nothing to send (or persist) when the agent produced no final output
+        if final_data is not None:
+            logger.debug("[WORKFLOW]   - Sending final 'awx-chat' payload.")
+            # The final payload and the history write are independent, so run them concurrently
+            pending = [websocket.send_json({"request_type": socket_request_type["chat"], "content": final_data})]
+            if new_messages is not None:
+                pending.append(save_history(user_id, new_messages))
+            for outcome in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(outcome, Exception):
+                    logger.error("[WORKFLOW] Sending final payload or saving history failed: %s", outcome)
     except InputGuardrailTripwireTriggered as e:
         # This block catches the exception when our ui_request_guardrail triggers the tripwire.
         # This failed turn is NOT saved to history.
         
         # Safely get the reasoning from the guardrail's output.
-        reasoning = "No specific reason provided."
-        if (hasattr(e, 'guardrail_result') and e.guardrail_result and
-            hasattr(e.guardrail_result, 'output') and e.guardrail_result.output and
-            hasattr(e.guardrail_result.output, 'output_info') and e.guardrail_result.output.output_info and
-            hasattr(e.guardrail_result.output.output_info, 'reasoning')):
+        try:
             reasoning = e.guardrail_result.output.output_info.reasoning
+        except AttributeError:
+            reasoning = "No specific reason provided."
         
-        print(f"[WORKFLOW] [GUARDRAIL] Request blocked. Reason: {reasoning}")
+        logger.warning("[WORKFLOW] [GUARDRAIL] Request blocked. Reason: %s", reasoning)
         # Inform the client that the request was blocked, including the reason.
         await websocket.send_json({
             "request_type": socket_request_type["chat"],
             "content": {"explanation": "I am here to help you with Ansible AWX so right now I can't help you with that."}
         })
-        # Save original user message without [USER_ID: xxx] prefix
-        updated_history = history + [{"role": "user", "content": user_message}, {"role": "assistant", "content": "I am here to help you with Ansible AWX so right now I can't help you with that."}]
-        save_history(user_id, updated_history)
+        await save_history(user_id, [{"role": "user", "content": user_message}, {"role": "assistant", "content": "I am here to help you with Ansible AWX so right now I can't help you with that."}])
         # This turn failed, so we don't return anything or modify history.
         return
 
@@ -313,6 +395,8 @@ async def handle_awx_chat(websocket: WebSocket, data: Dict, history: List[Dict])
 #     user_id: str = Field(description="User ID for the chat session")
 #     content: str = Field(description="User message content")
 #     request_type: str = Field(default="awx-chat", description="Type of request")
+# Background Slack tasks currently running
+background_tasks: set = set()
 # Note: This endpoint is used for Slack webhook, it will response immediately to prevent duplicate message and process the response message in background.
 @app.post("/api/chat")
 async def api_chat(request: Request):
@@ -331,29 +415,33 @@ async def api_chat(request: Request):
         slack_user_id = event.get('user')
         user_message = event.get('text')
         if slack_user_id is None or user_message is None:
-            print(f"[API] received unknown blank message -- SKIPPING: {channel} - user_id: {slack_user_id} - user_message: {user_message} - event type: {event_type}")
+            logger.debug("[API] received unknown blank message -- SKIPPING: %s - user_id: %s - user_message: %s - event type: %s", channel, slack_user_id, user_message, event_type)
             return {'ok': True}
         if event.get("subtype") == "bot_message" or event.get("bot_id") is not None:
-            print(f"[API] received bot message -- SKIPPING: {channel} - user_id: {slack_user_id} - user_message: {user_message} - event type: {event_type}")
+            logger.debug("[API] received bot message -- SKIPPING: %s - user_id: %s - user_message: %s - event type: %s", channel, slack_user_id, user_message, event_type)
             return {'ok': True}
-        print(f"[API] received channel: {channel} - user_id: {slack_user_id} - user_message: {user_message} - event type: {event_type}")
-        asyncio.create_task(background_slack_response(channel, slack_user_id, user_message, event_type, the_leader_agent))
+        logger.info("[API] received channel: %s - user_id: %s - user_message: %s - event type: %s", channel, slack_user_id, user_message, event_type)
+        # Ack Slack right away (3 second deadline), the agent runs in the background.
+        # Keep a reference to the task so it is not garbage collected before it finishes.
+        # Retries of an event keep its event_id, which is used to answer each message only once
+        event_id = data.get('event_id') or event.get('client_msg_id')
+        task = asyncio.create_task(background_slack_response(channel, slack_user_id, user_message, event_type, the_leader_agent, event_id))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
         return {'ok': True}
             
     except InputGuardrailTripwireTriggered as e:
         # Handle guardrail blocks same as WebSocket
-        reasoning = "No specific reason provided."
-        if (hasattr(e, 'guardrail_result') and e.guardrail_result and
-            hasattr(e.guardrail_result, 'output') and e.guardrail_result.output and
-            hasattr(e.guardrail_result.output, 'output_info') and e.guardrail_result.output.output_info and
-            hasattr(e.guardrail_result.output.output_info, 'reasoning')):
+        try:
             reasoning = e.guardrail_result.output.output_info.reasoning
+        except AttributeError:
+            reasoning = "No specific reason provided."
         
-        print(f"[API] [GUARDRAIL] Request blocked. Reason: {reasoning}")
+        logger.warning("[API] [GUARDRAIL] Request blocked. Reason: %s", reasoning)
         return {'ok': True}
         
     except Exception as e:
-        print(f"[API] [ERROR] An unexpected error occurred: {e}")
+        logger.error("[API] An unexpected error occurred: %s", e)
         return {'ok': True}
 
 # ==========================================================
@@ -365,9 +453,9 @@ async def login_from_slack(request: Request):
     Login from Slack endpoint
     """
     form_data = await request.form()
-    payload = json.loads(form_data["payload"])
+    payload = orjson.loads(form_data["payload"])
     if payload["type"] == "block_actions":
-        open_login_modal(payload["trigger_id"], payload["container"]["channel_id"])
+        await open_login_modal(payload["trigger_id"], payload["container"]["channel_id"])
         return {"response_action": "clear"}
     elif payload["type"] == "view_submission":
         await login_ldap_from_slack(payload)
@@ -389,12 +477,12 @@ async def health_check():
             redis_status = "not available"
         else:
             try:
-                redis_client.ping()
+                await redis_client.ping()
             except Exception as e:
                 redis_status = f"unhealthy: {str(e)}"
         
         # Check active WebSocket connections
-        active_ws_count = len(active_connections)
+        active_ws_count = await connection_registry.count()
         
         return {
             "status": "healthy",
@@ -416,6 +504,16 @@ async def health_check():
 
 # --- Uvicorn Server Runner ---
 # This block allows you to run the server directly with `python main.py`
+# With WORKERS > 1, put the workers behind a load balancer with sticky sessions for /ws/{user_id}.
 if __name__ == "__main__":
     port = int(os.getenv("MAIN_PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
\ No newline at end of file
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        workers=int(os.getenv("WORKERS", 2)),
+        reload=os.getenv("DEV") == "1",  # file watcher only in development
+    )
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Compile the project .env file into _env_generated.py (read by settings.py)
+
+Run at deploy time (python scripts/compile_env.py). The app then imports the settings as a Python dict literal,
+served from the bytecode cache, instead of parsing .env on every start. Delete the generated file to go back to
+reading .env directly (development).
+"""
+
+import os
+import sys
+from pathlib import Path
+from dotenv import dotenv_values
+
+ROOT = Path(__file__).resolve().parents[1]
+ENV_FILE = ROOT / ".env"
+OUTPUT_FILE = ROOT / "_env_generated.py"
+
+
+def main() -> int:
+    if not ENV_FILE.is_file():
+        print(f"{ENV_FILE} not found", file=sys.stderr)
+        return 1
+    # Keys without a value (None) are left out, like load_dotenv does
+    config = {key: value for key, value in dotenv_values(ENV_FILE).items() if value is not None}
+    lines = [
+        f'"""Generated from {ENV_FILE.name} by scripts/compile_env.py - do not edit, re-run the script instead."""',
+        "",
+        "CONFIG: dict[str, str] = {",
+        *(f"    {key!r}: {value!r}," for key, value in sorted(config.items())),
+        "}",
+        "",
+    ]
+    # The file holds secrets: only the owner can read it
+    fd = os.open(OUTPUT_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    print(f"Wrote {len(config)} settings to {OUTPUT_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+Environment of the app
+
+The project .env file is loaded into os.environ once per process, when this module is first imported. Every entry
+point imports it before reading os.environ (main.py first thing, conversations.redis_pool before building the pool).
+ENV holds the parsed values (.env over the process environment). refresh_env() re-parses the file only
+when it has changed, so per-user settings can still be edited without restarting the app.
+
+In production, scripts/compile_env.py compiles .env into _env_generated.py: the settings are then
+imported from that module (no text parsing) and stay fixed until the next deploy.
+"""
+
+import os
+from pathlib import Path
+from dotenv import load_dotenv, dotenv_values
+
+try:
+    from _env_generated import CONFIG
+except ImportError:
+    CONFIG = None
+
+ENV_FILE = Path(__file__).resolve().parent / ".env"
+if CONFIG is None:
+    load_dotenv(ENV_FILE)
+else:
+    # Same semantics as load_dotenv: the process environment wins
+    for key, value in CONFIG.items():
+        os.environ.setdefault(key, value)
+
+ENV: dict = {}
+_env_mtime_ns = None
+
+def _env_file_mtime_ns() -> int:
+    try:
+        return os.stat(ENV_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+def refresh_env() -> int:
+    """
+    Re-parse the .env file into ENV if it changed since the last parse.
+    Returns the modification time ENV now matches, usable as a cache key.
+    """
+    global _env_mtime_ns
+    # Compiled settings never change at runtime
+    mtime_ns = 0 if CONFIG is not None else _env_file_mtime_ns()
+    if mtime_ns != _env_mtime_ns:
+        # Values from .env win over the process environment, like load_dotenv(override=True)
+        ENV.clear()
+        ENV.update(os.environ)
+        ENV.update(CONFIG if CONFIG is not None else dotenv_values(ENV_FILE))
+        _env_mtime_ns = mtime_ns
+    return mtime_ns
+
+refresh_env()
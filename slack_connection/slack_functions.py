@@ -1,96 +1,181 @@
 import os
 import asyncio
-import json
-import requests
-from requests.auth import HTTPBasicAuth
+import orjson
+import aiohttp
+import ijson
+import httpx
 import redis
+import logging
+from cachetools import TTLCache
 from fastapi import Request
-from conversations.conversation import redis_client, get_history, save_history
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+from agents import InputGuardrailTripwireTriggered
+from sub_agents.chat_guardrails import GUARDRAIL_ENABLED, SpeculativeGuardrail
+from conversations.conversation import redis_client, get_history, enqueue_history, decode_history, migrate_legacy_history, HISTORY_TTL, HISTORY_MAX, HISTORY_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# ==========================================================
+# --- Shared Slack Web API client ---
+# One client over one aiohttp session (keep-alive) for every Slack Web API call, opened/closed by the FastAPI lifespan.
+# Rate limited calls (HTTP 429) are retried by the SDK after the Retry-After delay.
+# ==========================================================
+slack_client: AsyncWebClient = None
+
+def open_slack_client():
+    """
+    Create the shared Slack Web API client. Must be called from the running event loop.
+    """
+    global slack_client
+    slack_client = AsyncWebClient(
+        token=os.getenv("SLACK_BOT_TOKEN"),
+        timeout=10,
+        session=aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=30.0))
+    )
+    slack_client.retry_handlers.append(AsyncRateLimitErrorRetryHandler(max_retry_count=3))
+
+async def close_slack_client():
+    """
+    Close the shared Slack Web API client session.
+    """
+    global slack_client
+    if slack_client is not None:
+        await slack_client.session.close()
+        slack_client = None
+
+# ==========================================================
+# --- Shared AWX HTTP client ---
+# Reused across LDAP logins so the TLS setup (verify=False) and the connection happen once, not per request.
+# ==========================================================
+awx_client: httpx.AsyncClient = None
+
+def open_awx_client():
+    """
+    Create the shared AWX HTTP client.
+    """
+    global awx_client
+    awx_client = httpx.AsyncClient(
+        base_url=os.getenv("ANSIBLE_BASE_URL", ""),
+        verify=False,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=30.0)
+    )
+
+async def close_awx_client():
+    """
+    Close the shared AWX HTTP client.
+    """
+    global awx_client
+    if awx_client is not None:
+        await awx_client.aclose()
+        awx_client = None
 
 # ==========================================================
 # --- Background Slack Response Function ---
 # ==========================================================
-async def background_slack_response(channel: str, slack_user_id: str, user_message: str, event_type: str, the_leader_agent):
+async def background_slack_response(channel: str, slack_user_id: str, user_message: str, event_type: str, the_leader_agent, event_id: str = None):
     """
     Background function to process Slack message and send response.
     """
-    # Check if user from slack has been provided awx_user_id
-    awx_user_id = get_user_id_from_slack_id(slack_user_id)
+    # Users known to be logged out get the login button without touching Redis
+    if slack_user_id in _unauth_cache:
+        await send_reply(channel, "", button=True, tagName=slack_user_id)
+        return
+    # Slack re-delivers an event it thinks failed; only the first delivery is answered
+    if not await claim_slack_event(event_id):
+        logger.info("[API] Duplicate Slack event %s -- SKIPPING", event_id)
+        return
+    # Check if user from slack has been provided awx_user_id, and get the history from Redis in the same round-trip
+    awx_user_id, history = await fetch_slack_context(slack_user_id)
     if awx_user_id != False:
         try:
-            # Get history from Redis
-            history = get_history(awx_user_id)
-            
-            # Embed user_id in the message content for agent to extract
-            enhanced_message = f"[USER_ID: {awx_user_id}] {user_message}"
-            
-            prompt_input = history.copy()
-            prompt_input.append({"role": "user", "content": enhanced_message})
+            prompt_input = [*history, {"role": "user", "content": user_message}]
             
-            print(f"[API] Executing agent: {the_leader_agent.name}")
+            logger.info("[API] Executing agent: %s", the_leader_agent.name)
             from agents import Runner
-            result = await Runner.run(the_leader_agent, prompt_input, max_turns=40)
+            # The guardrail check runs concurrently with the agent and is awaited before anything is replied
+            guardrail = SpeculativeGuardrail(prompt_input) if GUARDRAIL_ENABLED else None
+            result = await Runner.run(the_leader_agent, prompt_input, max_turns=40, hooks=guardrail, context={"user_id": awx_user_id})
+            if guardrail is not None:
+                await guardrail.check()
+            final_data = result.final_output.model_dump() if result.final_output else None
             
-            if result.final_output:
-                final_data = result.final_output.model_dump()
-                print(f"[API] Agent responsed with final output.")
+            if final_data:
+                logger.info("[API] Agent responsed with final output.")
                 
-                assistant_result = getattr(result.final_output, 'result', '')
-                assistant_explanation = getattr(result.final_output, 'explanation', '')
-                assistant_tool_name = getattr(result.final_output, 'tool_name', '')
+                assistant_result = final_data.get('result', '')
+                assistant_explanation = final_data.get('explanation', '')
+                assistant_tool_name = final_data.get('tool_name', '')
                 
                 if assistant_explanation:
                     assistant_message = {"role": "assistant", "content": assistant_explanation, "tool_result": assistant_result, "tool_name": assistant_tool_name}
-                    # Save original user message without [USER_ID: xxx] prefix
-                    updated_history = history + [{"role": "user", "content": user_message}, assistant_message]
-                    save_history(awx_user_id, updated_history)
-                    print("[API]   - Conversation history saved to Redis.")
+                    # Only the two new messages are written, by the background history writer, the reply doesn't wait for it
+                    enqueue_history(awx_user_id, [{"role": "user", "content": user_message}, assistant_message])
+                    logger.debug("[API]   - Conversation history queued for saving to Redis.")
                 slack_response = assistant_explanation + "\n\n" + assistant_result or "Task completed"
                 if event_type == "app_mention":
                     slack_response = f"Hi <@{slack_user_id}>, {slack_response}"
                 await send_reply(channel, slack_response)
             else:
                 await send_reply(channel, "No response generated")
+        except InputGuardrailTripwireTriggered as e:
+            try:
+                reasoning = e.guardrail_result.output.output_info.reasoning
+            except AttributeError:
+                reasoning = "No specific reason provided."
+            logger.warning("[API] [GUARDRAIL] Request blocked. Reason: %s", reasoning)
+            await send_reply(channel, "I am here to help you with Ansible AWX so right now I can't help you with that.")
         except Exception as e:
-            print(f"[API] [ERROR] Background task failed: {e}")
+            logger.error("[API] Background task failed: %s", e)
             await send_reply(channel, "Sorry, an error occurred while processing your request.")
     else:
         await send_reply(channel, "", button=True, tagName=slack_user_id)
 
+# ==========================================================
+# --- Duplicate Slack deliveries ---
+# Slack retries an event (same event_id) when it didn't get the ack in time. The first worker to claim the
+# event_id in Redis answers it, the retries are dropped: the agent never runs twice for one message.
+# ==========================================================
+SLACK_EVENT_DEDUPE_TTL = int(os.getenv("SLACK_EVENT_DEDUPE_TTL", 600))
+
+async def claim_slack_event(event_id: str) -> bool:
+    """
+    Return True if this delivery of the event must be processed, False for a retry of an event already claimed.
+    """
+    if not event_id or SLACK_EVENT_DEDUPE_TTL <= 0:
+        return True
+    try:
+        return bool(await redis_client.set(f"slack_event_{event_id}", 1, nx=True, ex=SLACK_EVENT_DEDUPE_TTL))
+    except redis.RedisError as e:
+        # Better to answer twice than not at all
+        logger.error("Error claiming Slack event in Redis: %s", e)
+        return True
+
 # ==========================================================
 # --- Slack reply to user ---
 # ==========================================================
+# The static parts of the login prompt are built once; only the user mention changes per message.
+LOGIN_ACTIONS_BLOCK = {
+    "type": "actions",
+    "elements": [
+        {
+            "type": "button",
+            "action_id": "open_login_modal",    # callback_id cho action
+            "text": {"type": "plain_text", "text": "Login"},
+            "value": "login_request"
+        }
+    ]
+}
+
 async def send_reply(channel, text, button: bool = False, tagName: str = ""):
-    url = "https://slack.com/api/chat.postMessage"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('SLACK_BOT_TOKEN')}",
-        "Content-Type": "application/json; charset=utf-8"
-    }
     if button:
-        login_button_block = [
-           {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn", 
-                    "text": f"<@{tagName}> Please login your LDAP account to continue."
-                }
-            },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "action_id": "open_login_modal",    # callback_id cho action
-                        "text": {"type": "plain_text", "text": "Login"},
-                        "value": "login_request"
-                    }
-                ]
-            }
-        ]
+        login_text = f"<@{tagName}> Please login your LDAP account to continue."
         payload = {
             "channel": channel,
-            "blocks": login_button_block,
-            "text": f"<@{tagName}> Please login your LDAP account to continue."  # fallback text
+            "blocks": [{"type": "section", "text": {"type": "mrkdwn", "text": login_text}}, LOGIN_ACTIONS_BLOCK],
+            "text": login_text  # fallback text
         }
     else:
         payload = {
@@ -98,28 +183,113 @@ async def send_reply(channel, text, button: bool = False, tagName: str = ""):
             "text": text,
             # "thread_ts": event_ts,  # Nếu muốn trả lời vào thread
         }
-    response = requests.post(url, headers=headers, json=payload)
+    try:
+        await slack_client.chat_postMessage(**payload)
+    except SlackApiError as e:
+        logger.error("send_reply() Slack API call failed: %s", e.response['error'])
     return {'ok': True}
 
 # ==========================================================
 # --- Check LDAP user from Redis ---
+# The slack_user_id -> awx_user_id mapping almost never changes, so it is kept in-process for a short time.
+# ==========================================================
+_slack_user_cache: TTLCache = TTLCache(maxsize=4096, ttl=300)
+# Slack users without a mapping (never logged in), so chatty unauthenticated users don't hit Redis on every message.
+# Each worker has its own cache; a login is published on SLACK_LOGIN_CHANNEL so every worker drops the user's entry.
+# Entries are only added while this worker listens on that channel, otherwise a login elsewhere would go unnoticed.
+_unauth_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+SLACK_LOGIN_CHANNEL = "slack_login"
+_login_pubsub = None
+_login_listener = None
+
+def cache_unauthenticated(slack_user_id: str):
+    if _login_listener is not None:
+        _unauth_cache[slack_user_id] = True
+
+async def start_login_listener():
+    """
+    Subscribe to the login notifications of the other workers (FastAPI lifespan startup).
+    Without Redis the negative cache just stays off.
+    """
+    global _login_pubsub, _login_listener
+    try:
+        _login_pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        await _login_pubsub.subscribe(SLACK_LOGIN_CHANNEL)
+    except redis.RedisError as e:
+        logger.error("Error subscribing to Slack logins, unauthenticated users won't be cached: %s", e)
+        return
+    _login_listener = asyncio.create_task(_listen_logins())
+
+async def stop_login_listener():
+    global _login_pubsub, _login_listener
+    if _login_listener is not None:
+        _login_listener.cancel()
+        await asyncio.gather(_login_listener, return_exceptions=True)
+        _login_listener = None
+    if _login_pubsub is not None:
+        await _login_pubsub.aclose()
+        _login_pubsub = None
+
+async def _listen_logins():
+    # Poll with a timeout rather than listen(): a blocking read would hit the pool's socket_timeout on an idle channel.
+    while True:
+        try:
+            message = await _login_pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None:
+                _unauth_cache.pop(message["data"], None)
+        except redis.RedisError as e:
+            # Logins published meanwhile are missed: start over with an empty cache
+            logger.error("Error reading Slack logins from Redis: %s", e)
+            _unauth_cache.clear()
+            await asyncio.sleep(1.0)
+
 # ==========================================================
-def get_user_id_from_slack_id(slack_user_id: str) -> str:
+# --- Resolve Slack user and load history in one Redis call ---
+# The history key depends on the awx_user_id stored in the Slack mapping, so a plain pipeline can't fetch both.
+# The script reads the mapping, then the history list (refreshing its TTL like get_history does).
+# ==========================================================
+SLACK_CONTEXT_LUA = """
+local mapping = redis.call('GET', KEYS[1])
+if not mapping then
+    return {false, false}
+end
+local ok, data = pcall(cjson.decode, mapping)
+if not ok or type(data) ~= 'table' or data['awx_user_id'] == nil or data['awx_user_id'] == '' then
+    return {false, false}
+end
+local user_id = tostring(data['awx_user_id'])
+local history_key = ARGV[3] .. user_id
+local history = redis.call('LRANGE', history_key, 0, tonumber(ARGV[2]) - 1)
+if #history > 0 then
+    redis.call('EXPIRE', history_key, ARGV[1])
+end
+return {user_id, history}
+"""
+slack_context_script = redis_client.register_script(SLACK_CONTEXT_LUA)
+
+async def fetch_slack_context(slack_user_id: str):
     """
-    Get the real user id from Slack user id
+    Get the real user id from Slack user id together with the user's conversation history.
+    Returns (False, []) when the Slack user has not logged in yet.
     """
     if redis_client is None:
-        print("Redis not available, returning empty history")
-        return False
-    redis_slack_key = f"slack_user_{slack_user_id}"
-    user_data = redis_client.get(redis_slack_key)
-    if user_data is None:
-        return False
-    user_data = json.loads(user_data)
-    user_id = user_data.get("awx_user_id", "")
-    if user_id == "":
-        return False
-    return user_id
+        logger.warning("Redis not available, returning empty history")
+        return False, []
+    if slack_user_id in _slack_user_cache:
+        user_id = _slack_user_cache[slack_user_id]
+        return user_id, await get_history(user_id, use_cache=False)
+    try:
+        user_id, user_data = await slack_context_script(keys=[f"slack_user_{slack_user_id}"], args=[HISTORY_TTL, HISTORY_MAX, HISTORY_KEY_PREFIX])
+        if user_id is None:
+            cache_unauthenticated(slack_user_id)
+            return False, []
+        _slack_user_cache[slack_user_id] = user_id
+        if not user_data:
+            user_data = await migrate_legacy_history(user_id)
+        return user_id, decode_history(user_id, user_data, use_cache=False)
+    except (redis.RedisError, ValueError) as e:
+        logger.error("Error getting Slack context from Redis: %s", e)
+        return False, []
 
 # ==========================================================
 # --- Get user info from LDAP ---
@@ -135,23 +305,28 @@ async def login_ldap_from_slack(data: dict):
         slack_user_id = data["user"]["id"]
         channel_id = data["view"]["private_metadata"]
         try:
-            awx_host = os.getenv("ANSIBLE_BASE_URL")
-
-            url = f"{awx_host}/api/v2/me/"
-            response = requests.get(url, auth=HTTPBasicAuth(username, password), verify=False)
+            response = await awx_client.get("/api/v2/me/", auth=(username, password))
 
             if response.status_code == 200:
-                info = response.json()
-                redis_client.set(f"slack_user_{slack_user_id}", json.dumps({"awx_user_id": info["results"][0]["id"]}))
+                # Only results[0].id is needed, so pull it out without building the whole /me/ document
+                awx_user_id = next(ijson.items(response.content, "results.item.id"))
+                await redis_client.set(f"slack_user_{slack_user_id}", orjson.dumps({"awx_user_id": awx_user_id}))
+                _slack_user_cache[slack_user_id] = str(awx_user_id)
+                _unauth_cache.pop(slack_user_id, None)
+                # The other workers may have this user cached as logged out too
+                try:
+                    await redis_client.publish(SLACK_LOGIN_CHANNEL, slack_user_id)
+                except redis.RedisError as e:
+                    logger.error("Error publishing Slack login: %s", e)
                 await send_reply(channel_id, f"Login with LDAP success, now you can use AWX assistant.")
             else:
                 await send_reply(channel_id, f"Login with LDAP failed, please try again.")
-                print("login_ldap_from_slack() API call failed, status code: ", response.status_code, " - response: ", response.text)
+                logger.warning("login_ldap_from_slack() API call failed, status code: %s - response: %s", response.status_code, response.text)
         except Exception as e:
-            print(f"Error parsing request JSON in login_ldap_from_slack(): {e} \n data: {data}")
+            logger.error("Error parsing request JSON in login_ldap_from_slack(): %s", e)
             data = {}
     except Exception as e:
-        print(f"Error parsing request JSON in login_ldap_from_slack(): {e} \n data: {data}")
+        logger.error("Error parsing request JSON in login_ldap_from_slack(): %s", e)
         data = {}
     
     
@@ -160,35 +335,38 @@ async def login_ldap_from_slack(data: dict):
 # ==========================================================
 # --- Open login modal ---
 # ==========================================================
-def open_login_modal(trigger_id, channel_id):
-    url = "https://slack.com/api/views.open"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('SLACK_BOT_TOKEN')}",
-        "Content-Type": "application/json"
+# The login form never changes, only private_metadata (the channel to answer in) is set per request.
+LOGIN_MODAL_BLOCKS = [
+    {
+        "type": "input",
+        "block_id": "username_block",
+        "element": {"type": "plain_text_input", "action_id": "username_input"},
+        "label": {"type": "plain_text", "text": "Username"}
+    },
+    {
+        "type": "input",
+        "block_id": "password_block",
+        "element": {"type": "plain_text_input", "action_id": "password_input"},
+        "label": {"type": "plain_text", "text": "Password"}
     }
+]
+LOGIN_MODAL_TITLE = {"type": "plain_text", "text": "Login to AWX"}
+LOGIN_MODAL_SUBMIT = {"type": "plain_text", "text": "Login"}
+
+async def open_login_modal(trigger_id, channel_id):
     modal_view = {
         "type": "modal",
         "callback_id": "login_form",
-        "title": {"type": "plain_text", "text": "Login to AWX"},
-        "submit": {"type": "plain_text", "text": "Login"},
+        "title": LOGIN_MODAL_TITLE,
+        "submit": LOGIN_MODAL_SUBMIT,
         "private_metadata": channel_id,
-        "blocks": [
-            {
-                "type": "input",
-                "block_id": "username_block",
-                "element": {"type": "plain_text_input", "action_id": "username_input"},
-                "label": {"type": "plain_text", "text": "Username"}
-            },
-            {
-                "type": "input",
-                "block_id": "password_block",
-                "element": {"type": "plain_text_input", "action_id": "password_input"},
-                "label": {"type": "plain_text", "text": "Password"}
-            }
-        ]
+        "blocks": LOGIN_MODAL_BLOCKS
     }
     payload = {
         "trigger_id": trigger_id,
         "view": modal_view,
     }
-    requests.post(url, headers=headers, json=payload)
\ No newline at end of file
+    try:
+        await slack_client.views_open(**payload)
+    except SlackApiError as e:
+        logger.error("open_login_modal() Slack API call failed: %s", e.response['error'])
\ No newline at end of file
@@ -0,0 +1,18 @@
+"""
+Settings of the sub agents
+
+The environment itself is loaded by the top-level settings module; this module only adds the model settings
+every agent needs, so importing it fails fast when they are missing.
+"""
+
+import os
+from typing import Final
+# Imported for its side effect: .env (or the compiled settings) is put into os.environ
+import settings
+
+# Model used by every agent; fail at startup rather than passing None to each Agent
+AI_MODEL: Final[str] = os.getenv("AI_MODEL")
+if not AI_MODEL:
+    raise RuntimeError("AI_MODEL environment variable is required")
+# The guardrail only classifies requests as valid/invalid, so a smaller, faster model can be set for it
+GUARDRAIL_MODEL: Final[str] = os.getenv("GUARDRAIL_MODEL") or AI_MODEL
@@ -1,21 +1,26 @@
 import os
-from agents import Agent, mcp, function_tool
+import re
+import logging
+import functools
+from agents import Agent, AgentOutputSchema, RunContextWrapper, function_tool
 from pydantic import BaseModel, Field
-from dotenv import load_dotenv
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Tuple
+from dataclasses import dataclass
+from collections import defaultdict
+from agent_tools.cached_mcp_server import CachedToolsMCPServerStreamableHttp
+from agent_tools.mcp_session_pool import MCPSessionPool
+from settings import ENV, refresh_env
+from sub_agents._env import AI_MODEL
+from sub_agents.prompts import load_prompt
+
+logger = logging.getLogger(__name__)
 
-load_dotenv(Path(__file__).parent.parent / ".env")
 # 1. Khai báo MCP Server nếu được enable
 mcp_servers = []
 if os.getenv("ENABLE_GITHUB_MCP", "false").lower() == "true":
     github_token = os.getenv("GITHUB_PERSONAL_ACCESS_TOKEN")
     if github_token:
-        # Tạo tool filter để giới hạn quyền
-        tool_filter = mcp.create_static_tool_filter(
-            blocked_tool_names=["delete_repository", "create_repository", "delete_file", "switch_branch"]
-        )
-
         # Gom các tham số kết nối vào một dictionary - GitHub Copilot MCP endpoint
         params = {
             "url": "https://api.githubcopilot.com/mcp/",  # Thêm trailing slash
@@ -30,20 +35,28 @@ if os.getenv("ENABLE_GITHUB_MCP", "false").lower() == "true":
         }
 
         # Khai báo server và truyền dict `params` vào
-        github_mcp_server = mcp.server.MCPServerStreamableHttp(
+        # The tool list is cached in-process and persisted on disk, so worker restarts don't re-fetch it
+        github_mcp_server = CachedToolsMCPServerStreamableHttp(
             params=params,
-            # tool_filter=tool_filter,  # Enabled tool filter để giới hạn quyền
-            cache_tools_list=True  # Cache để tăng tốc
+            cache_file=Path(__file__).resolve().parents[1] / ".mcp_tools_cache.json"
         )
         mcp_servers.append(github_mcp_server)
-        print("✅ GitHub Copilot MCP integration configured for GitHub worker.")
+        logger.info("GitHub Copilot MCP integration configured for GitHub worker.")
     else:
-        print("⚠️  ENABLE_GITHUB_MCP is true, but GITHUB_PERSONAL_ACCESS_TOKEN is not set for the GitHub worker.")
+        logger.warning("ENABLE_GITHUB_MCP is true, but GITHUB_PERSONAL_ACCESS_TOKEN is not set for the GitHub worker.")
+MCP_SERVERS: tuple = tuple(mcp_servers)
+del mcp_servers
+
+# The MCP sessions stay open for the whole process and are shared by every agent run
+mcp_session_pool = MCPSessionPool(MCP_SERVERS)
 
 async def connect_github_server():
-    """Connect GitHub MCP server"""
-    for server in mcp_servers:
-        await server.connect()
+    """Connect GitHub MCP servers concurrently (only once per process)"""
+    await mcp_session_pool.connect_all()
+
+async def close_github_server():
+    """Close the GitHub MCP sessions"""
+    await mcp_session_pool.close_all()
 
 # 2. Định nghĩa Pydantic output model
 class github_worker_output(BaseModel):
@@ -55,115 +68,106 @@ class github_worker_output(BaseModel):
     tool_name: str = Field(description="The name of the GitHub tool used.")
 
 # 3. Function để tạo repository config dựa trên user_id
-def get_user_repository_config(user_id: str = None):
+@dataclass(frozen=True, slots=True)
+class GithubConfig:
+    allowed_repository: Optional[str] = None
+    allowed_branch: Optional[str] = None
+    repository_url: Optional[str] = None
+    repository_ref: Optional[str] = None
+    repository_owner: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        return {
+            'ALLOWED_REPOSITORY': self.allowed_repository,
+            'ALLOWED_BRANCH': self.allowed_branch,
+            'REPOSITORY_URL': self.repository_url,
+            'REPOSITORY_REF': self.repository_ref,
+            'REPOSITORY_OWNER': self.repository_owner,
+        }
+
+# Env key prefix -> GithubConfig field. "<PREFIX>_<user_id>" overrides the default "<PREFIX>" for that user.
+_CONFIG_KEYS = {
+    "ALLOWED_REPOSITORY": "allowed_repository",
+    "ALLOWED_BRANCH": "allowed_branch",
+    "REPOSITORY_URL": "repository_url",
+    "REPOSITORY_REF": "repository_ref",
+    "REPOSITORY_OWNER": "repository_owner",
+}
+_USER_CONFIG_KEY = re.compile(rf"({'|'.join(_CONFIG_KEYS)})_(.+)")
+
+@functools.lru_cache(maxsize=1)
+def _build_config_table(env_mtime_ns: int) -> Tuple[GithubConfig, Dict[str, GithubConfig]]:
+    """
+    Scan the environment once and build the default config plus one config per user_id found in the keys.
+    Rebuilt only when the .env file changes (see settings.py).
+    """
+    defaults = {field: ENV.get(key) for key, field in _CONFIG_KEYS.items()}
+    overrides = defaultdict(dict)
+    for key, value in ENV.items():
+        # An empty per-user value falls back to the default, like `user_value or default`
+        match = _USER_CONFIG_KEY.fullmatch(key) if value else None
+        if match:
+            overrides[match.group(2)][_CONFIG_KEYS[match.group(1)]] = value
+    users = {user_id: GithubConfig(**{**defaults, **fields}) for user_id, fields in overrides.items()}
+    return GithubConfig(**defaults), users
+
+def clear_user_github_config_cache():
+    """Forget every cached user config"""
+    _build_config_table.cache_clear()
+
+def get_user_repository_config(user_id: str = None) -> GithubConfig:
     """Load repository configuration for specific user"""
-    # Reload environment variables to get latest values
-    load_dotenv(Path(__file__).parent.parent / ".env", override=True)
-    
-    # Build config keys with user_id suffix if provided
-    if user_id:
-        allowed_repo_key = f"ALLOWED_REPOSITORY_{user_id}"
-        allowed_branch_key = f"ALLOWED_BRANCH_{user_id}"
-        repo_url_key = f"REPOSITORY_URL_{user_id}"
-        repo_ref_key = f"REPOSITORY_REF_{user_id}"
-        repo_owner_key = f"REPOSITORY_OWNER_{user_id}"
-    else:
-        # Fallback to default keys
-        allowed_repo_key = "ALLOWED_REPOSITORY"
-        allowed_branch_key = "ALLOWED_BRANCH"
-        repo_url_key = "REPOSITORY_URL"
-        repo_ref_key = "REPOSITORY_REF"
-        repo_owner_key = "REPOSITORY_OWNER"
-    
-    config = {
-        'ALLOWED_REPOSITORY': os.getenv(allowed_repo_key, os.getenv("ALLOWED_REPOSITORY")),
-        'ALLOWED_BRANCH': os.getenv(allowed_branch_key, os.getenv("ALLOWED_BRANCH")),
-        'REPOSITORY_URL': os.getenv(repo_url_key, os.getenv("REPOSITORY_URL")),
-        'REPOSITORY_REF': os.getenv(repo_ref_key, os.getenv("REPOSITORY_REF")),
-        'REPOSITORY_OWNER': os.getenv(repo_owner_key, os.getenv("REPOSITORY_OWNER"))
-    }
-    
-    print(f"🔧 GitHub Config for user '{user_id}':")
-    print(f"   - Repository: {config['REPOSITORY_OWNER']}/{config['ALLOWED_REPOSITORY']}")
-    print(f"   - Branch: {config['ALLOWED_BRANCH']}")
-    print(f"   - URL: {config['REPOSITORY_URL']}")
-    
+    default_config, user_configs = _build_config_table(refresh_env())
+    config = user_configs.get(user_id, default_config) if user_id else default_config
+    logger.debug("GitHub config for user '%s': %s/%s on %s (%s)", user_id, config.repository_owner,
+                 config.allowed_repository, config.allowed_branch, config.repository_url)
     return config
 
 # Tool function for agent to load user config
+# The WebSocket and Slack chats pass the authenticated user_id in the run context (context={"user_id": ...}).
+# It is read from there, never taken from the model: a user can't load someone else's configuration by typing their id.
 @function_tool
-def load_user_github_config(user_id: str) -> Dict:
+def load_user_github_config(ctx: RunContextWrapper) -> Dict:
     """
-    Load GitHub repository configuration for a specific user.
+    Load the GitHub repository configuration of the current user.
     This function is available as a tool for the GitHub worker agent.
     
-    Args:
-        user_id: The user ID to load configuration for
-        
     Returns:
-        Dict containing repository configuration for the user
+        Dict containing repository configuration for the user, or an error when the user is not authenticated
     """
-    return get_user_repository_config(user_id)
+    user_id = ctx.context.get("user_id") if isinstance(ctx.context, dict) else None
+    if not user_id:
+        return {"error": "No authenticated user for this conversation, the repository configuration is not available."}
+    return get_user_repository_config(user_id).as_dict()
 
 # 4. Instructions cho agent - sẽ load config dynamic
-github_worker_instructions = """
-You are a specialized GitHub worker agent with RESTRICTED ACCESS. You ALWAYS operate exclusively on a single, pre-defined GitHub repository and branch.
-
-IMPORTANT: Before performing any GitHub operations, you must:
-1. Extract the user_id from the message content (look for "[USER_ID: xxx]" pattern at the beginning of user messages)
-2. Use the load_user_github_config tool with that user_id to get the repository configuration
-3. Use that configuration for all subsequent GitHub operations (owner, repo, branch, ref, etc.)
-
-CRITICAL RESTRICTIONS:
-- You are STRICTLY LIMITED to working on the single branch specified in the user's configuration
-- You MUST NOT switch branches or work on any other branch
-- If user requests to switch branch, checkout another branch, or work on different branch, REFUSE and explain that you can only work on their designated branch
-- All operations must be performed on the configured branch only
-
-## Tool Usage Guidelines:
-
-* When using `get_file_contents`:
-  - For root directory: omit the `path` parameter or use empty string
-  - For specific files: use the file path (e.g., "README.md", "src/main.py")
-  - For directories: use the directory path (e.g., "src", "docs")
-  - Always use the correct `ref` based on user's repository configuration. Ex: for user in "dat" branch, the ref is heads/dat (https://api.github.com/repos/thehien0121/infra_awx_playbooks/git/ref/heads/dat)
-  - If there is no specific file path, use path = "/"
-* When using `search_code`: use specific search terms, not broad queries
-
-## Error Handling:
-
-* If a tool call times out (especially search_code), explain the timeout and suggest trying again with more specific search terms.
-* For API rate limiting errors, explain the limitation and suggest waiting before retrying.
-* If GitHub API is unavailable, provide a clear explanation of the service status.
-* For 404 errors, check if the repository is private and token has correct permissions.
-* Always include the specific error details in your response for debugging purposes.
-
-## Repository Configuration:
-
-You must dynamically load repository configuration based on the user_id from the conversation context.
-Use the load_user_github_config tool to get the appropriate configuration for each user.
-
-Example workflow:
-1. User message: "[USER_ID: john] hiện tôi đang ở branch nào?" → extract user_id="john"
-2. Call load_user_github_config(user_id="john") → get config  
-3. Use returned config for GitHub operations (owner, repo, ref, etc.)
-4. Answer user's question using the correct repository/branch information
-
-Example of REFUSING branch switch requests:
-- User: "switch to main branch" → Answer: "I can only work on your designated branch: [user's configured branch]. I cannot switch branches."
-- User: "checkout develop branch" → Answer: "Access denied. I am restricted to working on branch: [user's configured branch] only."
-- User: "create branch feature/new" → Answer: "I cannot create or switch branches. All operations must be performed on your configured branch: [user's configured branch]."
-"""
+# The user's repository configuration (user_id from the run context, see load_user_github_config) is written straight
+# into the instructions. Without a user_id in the context the agent refuses GitHub operations.
+def github_worker_instructions(context: RunContextWrapper, agent: Agent) -> str:
+    user_id = context.context.get("user_id") if isinstance(context.context, dict) else None
+    if not user_id:
+        return f"{load_prompt('github_worker')}\n\n{load_prompt('github_worker_no_user')}"
+    config = get_user_repository_config(user_id)
+    return (
+        f"{load_prompt('github_worker')}\n\n"
+        "## Repository Configuration:\n\n"
+        "Use this configuration for all GitHub operations (owner, repo, branch, ref, etc.):\n"
+        f"- Owner: {config.repository_owner}\n"
+        f"- Repository: {config.allowed_repository}\n"
+        f"- Branch: {config.allowed_branch}\n"
+        f"- Ref: {config.repository_ref}\n"
+        f"- URL: {config.repository_url}"
+    )
 
 # 5. Tạo Agent
 awx_github_agent = Agent(
     name="GitHub Worker Agent",
     instructions=github_worker_instructions,
-    output_type=github_worker_output,
-    model=os.getenv("AI_MODEL"),
+    output_type=AgentOutputSchema(github_worker_output),
+    model=AI_MODEL,
     handoff_description="Use this agent for all operations related to GitHub, such as managing repositories, issues, pull requests, and searching code.",
-    mcp_servers=mcp_servers,
+    mcp_servers=list(MCP_SERVERS),
     tools=[load_user_github_config]  # Thêm custom tool để load config
 )
 
-print(f"Agent '{awx_github_agent.name}' initialized with {len(mcp_servers)} MCP server(s).")
\ No newline at end of file
+logger.info("Agent '%s' initialized with %d MCP server(s).", awx_github_agent.name, len(MCP_SERVERS))
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Semantic cache of guardrail verdicts (optional)
+
+Paraphrases of an already classified conversation ("how do I write a playbook?" / "help me author an Ansible playbook")
+reuse its verdict instead of calling the classifier model: the conversation is embedded with a small sentence
+transformer and looked up in an in-memory HNSW index.
+Enabled with GUARDRAIL_SEMANTIC_CACHE=true; needs the optional sentence-transformers and hnswlib packages.
+"""
+
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("GUARDRAIL_SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_MODEL = os.getenv("GUARDRAIL_SEMANTIC_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Minimum cosine similarity for two conversations to share a verdict
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("GUARDRAIL_SEMANTIC_THRESHOLD", 0.92))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("GUARDRAIL_SEMANTIC_MAX_ENTRIES", 10000))
+
+
+class SemanticVerdictCache:
+    def __init__(self, model_name: str, threshold: float, max_entries: int):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.disabled = False
+        self._encoder = None
+        self._index = None
+        self._dim = None
+        self._verdicts = []
+        self._load_lock = asyncio.Lock()
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+
+        encoder = SentenceTransformer(self.model_name)
+        self._dim = encoder.get_sentence_embedding_dimension()
+        self._index = self._new_index()
+        self._encoder = encoder
+        logger.info("Guardrail semantic cache loaded (%s)", self.model_name)
+
+    def _new_index(self):
+        # An hnswlib index can only be initialized once, so emptying the cache means building a new one
+        import hnswlib
+
+        index = hnswlib.Index(space="cosine", dim=self._dim)
+        index.init_index(max_elements=self.max_entries)
+        return index
+
+    async def embed(self, text: str):
+        """
+        Return the normalized embedding of the text, or None when the cache is unavailable.
+        The model is loaded on first use; loading and encoding run in a thread, off the event loop.
+        """
+        if self.disabled:
+            return None
+        if self._encoder is None:
+            async with self._load_lock:
+                if self._encoder is None:
+                    try:
+                        await asyncio.to_thread(self._load)
+                    except Exception as e:
+                        logger.warning("Guardrail semantic cache disabled: %s", e)
+                        self.disabled = True
+                        return None
+        return await asyncio.to_thread(lambda: self._encoder.encode([text], normalize_embeddings=True)[0])
+
+    def lookup(self, vector):
+        """
+        Return the verdict of the most similar cached conversation, if it is similar enough.
+        """
+        if vector is None or not self._verdicts:
+            return None
+        labels, distances = self._index.knn_query(vector, k=1)
+        if 1 - distances[0][0] >= self.threshold:
+            return self._verdicts[labels[0][0]]
+        return None
+
+    def add(self, vector, verdict):
+        if vector is None:
+            return
+        if len(self._verdicts) >= self.max_entries:
+            # Full: start over rather than tracking which entries to evict
+            self._index = self._new_index()
+            self._verdicts.clear()
+        self._index.add_items([vector], [len(self._verdicts)])
+        self._verdicts.append(verdict)
+
+
+semantic_cache = (
+    SemanticVerdictCache(SEMANTIC_CACHE_MODEL, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES)
+    if SEMANTIC_CACHE_ENABLED else None
+)
@@ -0,0 +1,16 @@
+"""
+Agent instructions
+
+Each prompt lives in its own <name>.md file next to this module, so it can be edited without touching code.
+Files are read once per process and the text is interned, so every Agent built from a prompt shares one string.
+"""
+
+import sys
+from functools import cache
+from pathlib import Path
+
+PROMPTS_DIR = Path(__file__).resolve().parent
+
+@cache
+def load_prompt(name: str) -> str:
+    return sys.intern((PROMPTS_DIR / f"{name}.md").read_text(encoding="utf-8").strip())